@@ -1,77 +1,216 @@
+import dataclasses
 import datetime
 import logging
-import operator
+import statistics
+import sys
 import gbce_trading_config
+from bisect import bisect_right
+from collections import deque
 from numbers import Number
-from functools import reduce
 
-EXCHANGE_STOCKS = {} # Note : Ideally all stocks details/objects to be stored in database, this dict is maintained for assignment purpose
+def _epochNanoseconds(timestamp):
+    """
+    :param timestamp: datetime to be converted
+    :return: Integer nanoseconds since epoch, exact to the microsecond resolution of datetime
+    """
+    return round(timestamp.timestamp() * 1e6) * 1000
+
+
+class TradeWindow(object):
+    __slots__ = ('interval', 'totalPrices', 'quantities', 'timestamps', 'totalPrice', 'totalPriceCompensation', 'totalQuantity', 'generation')
+
+    def __init__(self, trades=(), interval=gbce_trading_config.TIME_INTERVAL):
+        """
+        Sliding window of a stock's trades over the last interval with running VWAP sums
+        :param trades: Optional iterable of Trade instances to load
+        :param interval: timedelta for which trades are retained
+        Note : Entries are kept ordered by timestamp in parallel deques so expired trades are evicted from the left
+        """
+        self.interval = interval // datetime.timedelta(microseconds=1) * 1000
+        self.totalPrices = deque()
+        self.quantities = deque()
+        self.timestamps = deque() # Nanoseconds since epoch
+        self.totalPrice = 0.0
+        self.totalPriceCompensation = 0.0 # Rounding error lost from totalPrice, kept by Neumaier summation
+        self.totalQuantity = 0
+        self.generation = 0 # Incremented whenever a trade is added, lets GBCETrading detect its cached index is stale
+        for trade in trades:
+            self.append(trade)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, trade):
+        """
+        Adds the trade to the window, trades already older than the interval are dropped
+        :param trade: Trade instance to be stored
+        """
+        timestamp = trade.timestampNs
+        now = _epochNanoseconds(datetime.datetime.now())
+        self.evict(now)
+        if timestamp < now - self.interval:
+            logging.info('Trade at {0} is older than {1} minutes hence not added to the window'.format(trade.timestamp, gbce_trading_config.THRESHOLD_MINUTES))
+            return
+        self.generation += 1
+        totalPrice = trade.totalPrice
+        if not self.timestamps or timestamp >= self.timestamps[-1]:
+            self.totalPrices.append(totalPrice)
+            self.quantities.append(trade.quantity)
+            self.timestamps.append(timestamp)
+        else:
+            # Out of order trade, keep the deques sorted so eviction stays a left pop
+            index = bisect_right(self.timestamps, timestamp)
+            self.totalPrices.insert(index, totalPrice)
+            self.quantities.insert(index, trade.quantity)
+            self.timestamps.insert(index, timestamp)
+        self._addTotalPrice(totalPrice)
+        self.totalQuantity += trade.quantity
+
+    def _addTotalPrice(self, value):
+        """
+        Adds value to the running totalPrice with Neumaier compensated summation, so evicting a large trade by
+        subtracting it does not lose the precision of the remaining ones
+        :param value: price * quantity to add, negative to remove an evicted trade
+        """
+        totalPrice = self.totalPrice + value
+        if abs(self.totalPrice) >= abs(value):
+            self.totalPriceCompensation += (self.totalPrice - totalPrice) + value
+        else:
+            self.totalPriceCompensation += (value - totalPrice) + self.totalPrice
+        self.totalPrice = totalPrice
+
+    @property
+    def expiresAt(self):
+        """
+        :return: Time (ns since epoch) at which the oldest trade leaves the window, None if window is empty
+        """
+        return self.timestamps[0] + self.interval if self.timestamps else None
+
+    def evict(self, now):
+        """
+        Removes trades older than the interval and updates the running sums
+        :param now: Current time in nanoseconds since epoch
+        """
+        cutoff = now - self.interval
+        timestamps = self.timestamps
+        while timestamps and timestamps[0] < cutoff:
+            timestamps.popleft()
+            self._addTotalPrice(-self.totalPrices.popleft())
+            self.totalQuantity -= self.quantities.popleft()
+        if not timestamps:
+            # Reset so rounding left over from the subtractions is not carried forward
+            self.totalPrice = 0.0
+            self.totalPriceCompensation = 0.0
+            self.totalQuantity = 0
+
+    def volumeWeightedPrice(self, now):
+        """
+        :param now: Current time in nanoseconds since epoch
+        :return: Volume Weighted Price of trades in the window, None if there are no trades
+        """
+        self.evict(now)
+        if self.totalQuantity > 0:
+            return (self.totalPrice + self.totalPriceCompensation) / self.totalQuantity
+        return None
+
+
+class Exchange(object):
+    __slots__ = ('stocks',)
+
+    def __init__(self, stocks=None):
+        """
+        :param stocks: Optional dict of symbol to StockRecord to be used as the stocks of the exchange, not copied
+        Note : self.stocks maps symbol to StockRecord, ideally all stocks details/objects to be stored in database,
+        this dict is maintained for assignment purpose
+        """
+        self.stocks = stocks if stocks is not None else {}
+
+    def addStock(self, symbol, stockRecord):
+        """
+        Adds or replaces the stock details of the exchange
+        :param symbol: The symbol that identifies the stock
+        :param stockRecord: StockRecord holding the stock details
+        """
+        self.stocks[symbol] = stockRecord
+
+
+DEFAULT_EXCHANGE = Exchange()
+EXCHANGE_STOCKS = DEFAULT_EXCHANGE.stocks # Stocks of the default exchange, used when no exchange is given
+
 
 class Stock(object):
-    def __init__(self, symbol):
+    __slots__ = ('symbol', 'trades', 'exchange')
+
+    def __init__(self, symbol, exchange=None):
         """
         :param symbol: The symbol that identifies the stock
-        Note : self.trades holds list of recorded instances of Trade
+        :param exchange: Exchange in which the stock is listed, defaults to DEFAULT_EXCHANGE
+        Note : self.trades holds the TradeWindow of trades recorded in last TIME_INTERVAL, shared by reference with the StockRecord.
+        It is not a list of the recorded Trade instances, only the price * quantity, quantity and timestamp of trades still
+        in the window are kept, so it cannot be iterated and trades older than TIME_INTERVAL are dropped when recorded.
         """
-        self.symbol = symbol
-        self.trades = []
+        self.symbol = sys.intern(symbol)
+        self.trades = TradeWindow()
+        self.exchange = exchange if exchange is not None else DEFAULT_EXCHANGE
 
     def addStockDetails(self, type, lastDividend, parValue, fixedDividend=None):
         """
-        Adds the Stock details to EXCHANGE_STOCKS cache(dict)
+        Adds the Stock details to stocks cache(dict) of its exchange
         :param type: Type of Stock i.e. Common, Preferred (maintained in gbce_trading_config.StockType
         :param lastDividend: An absolute value that indicates the last dividend per share for the stock
         :param parValue: The face value per share for the stock
         :param fixedDividend: Percentage value that indicates fixed dividend to the face value of the share
         """
-        EXCHANGE_STOCKS[self.symbol] = {
-                                            gbce_trading_config.TYPE : type,
-                                            gbce_trading_config.LAST_DIVIDEND : lastDividend,
-                                            gbce_trading_config.FIXED_DIVIDEND : fixedDividend / 100 if fixedDividend else fixedDividend,
+        self.exchange.addStock(self.symbol, gbce_trading_config.StockRecord(
+                                            type=type,
+                                            lastDividend=lastDividend,
+                                            fixedDividend=fixedDividend / 100 if fixedDividend else fixedDividend,
                                             #As Fixed Dividend is represented in percentage so for proper calculations dividing by 100
-                                            gbce_trading_config.PAR_VALUE : parValue,
-                                            gbce_trading_config.TRADES : self.trades
-                                        }
+                                            parValue=parValue,
+                                            trades=self.trades
+                                        ))
 
     def recordTrade(self, trade):
         """
-        Records the trade and updates accordingly in EXCHANGE_STOCKS cache(dict)
+        Records the trade, exchange stocks cache(dict) sees it as the StockRecord shares self.trades by reference
+        Note : A trade older than TIME_INTERVAL is logged and dropped as it can no longer affect the Volume Weighted Stock Price
         :param trade: Trade instance for the share
         """
         if not isinstance(trade, Trade):
             raise TypeError('Argument trade {0} should be of type Trade'.format(trade))
-        elif self.symbol is not trade.symbol:
+        elif self.symbol != trade.symbol:
             raise ValueError('Argument trade {0} does not belong to this Stock'.format(trade.symbol))
         else:
             self.trades.append(trade)
-            EXCHANGE_STOCKS[self.symbol][gbce_trading_config.TRADES] = self.trades
 
     @staticmethod
     def getAllStocks():
         """
-        :return: Returns all Stocks details of exchange
+        :return: Returns all Stocks details of default exchange
         """
-        return EXCHANGE_STOCKS
+        return DEFAULT_EXCHANGE.stocks
 
     @staticmethod
     def getStock(symbol):
         """
         :param symbol: Symbol of Share for which details are required
-        :return: Returns Stock details for the given symbol
+        :return: Returns Stock details for the given symbol from default exchange
         """
-        return EXCHANGE_STOCKS[symbol]
+        return DEFAULT_EXCHANGE.stocks[symbol]
 
 
 class Trade(object):
-    def __init__(self, symbol, quantity, tradeType, price, timestamp=datetime.datetime.now()):
+    __slots__ = ('symbol', 'quantity', 'tradeType', 'price', 'timestamp', 'timestampNs')
+
+    def __init__(self, symbol, quantity, tradeType, price, timestamp=None):
         """
         :param symbol: The symbol that identifies the stock
         :param quantity: quantity of Stock for Buy/Sell
         :param tradeType: Buy or Sell
         :param price: Trade price
-        :param timestamp: Time at which trade took place
+        :param timestamp: Time at which trade took place, defaults to current time
         """
-        self.symbol = symbol
+        self.symbol = sys.intern(symbol)
         if quantity > 0:
             self.quantity = quantity
         else:
@@ -81,7 +220,8 @@ class Trade(object):
             self.price = price
         else:
             raise ValueError('Price of share should be positive')
-        self.timestamp = timestamp
+        self.timestamp = timestamp if timestamp is not None else datetime.datetime.now()
+        self.timestampNs = _epochNanoseconds(self.timestamp)
 
     @property
     def totalPrice(self):
@@ -91,82 +231,190 @@ class Trade(object):
         return self.quantity * self.price
 
 
+def _asStockRecord(details):
+    """
+    :param details: StockRecord or dict keyed by the Stock config names
+    :return: StockRecord whose trades are held in a TradeWindow
+    """
+    if isinstance(details, gbce_trading_config.StockRecord):
+        if isinstance(details.trades, TradeWindow):
+            return details
+        return dataclasses.replace(details, trades=TradeWindow(details.trades))
+    trades = details.get(gbce_trading_config.TRADES, ())
+    if not isinstance(trades, TradeWindow):
+        trades = TradeWindow(trades)
+    return gbce_trading_config.StockRecord.fromDict({**details, gbce_trading_config.TRADES: trades})
+
+
 class GBCETrading(object):
-    def __init__(self, stocks=None):
+    def __init__(self, stocks=None, exchange=None):
         """
-        :param stocks: All stock details of exchange
+        :param stocks: All stock details of exchange, either StockRecords or dicts keyed by the Stock config names
+        :param exchange: Exchange to trade on when stocks are not given, defaults to DEFAULT_EXCHANGE
+        Note : If every value of stocks is already a StockRecord holding a TradeWindow (e.g. Stock.getAllStocks()) the dict
+        itself is used, so stocks added to it later are seen. Otherwise the details are converted into a snapshot and
+        stocks added to the given dict later are not seen.
         """
-        self.stocks = stocks or Stock.getAllStocks()
+        if stocks and all(isinstance(details, gbce_trading_config.StockRecord) and isinstance(details.trades, TradeWindow)
+                          for details in stocks.values()):
+            self.exchange = Exchange(stocks)
+        elif stocks:
+            self.exchange = Exchange()
+            for symbol, details in stocks.items():
+                self.exchange.addStock(symbol, _asStockRecord(details))
+        else:
+            self.exchange = exchange if exchange is not None else DEFAULT_EXCHANGE
+        self.stocks = self.exchange.stocks
+        self._allShareIndex = None
+        self._allShareIndexWindows = None # (TradeWindow, generation) of every stock when the cached index was computed
+        self._allShareIndexExpiresAt = None
 
-    def getDividendYield(self, symbol, price):
+    def _getStockRecord(self, symbol):
         """
         :param symbol: The symbol that identifies the stock
-        :param price: Input price for which Dividend Yield to be calculated
-        :return: Dividend for the stock at given input price
+        :return: StockRecord for the symbol, raises ValueError if symbol is not present
         """
-        if symbol not in self.stocks:
+        stockRecord = self.stocks.get(symbol)
+        if stockRecord is None:
             raise ValueError('Symbol {0} is not present in current stocks. Please consider adding details for {0}'.format(symbol))
+        return stockRecord
+
+    @staticmethod
+    def _validatePrice(price):
+        """
+        :param price: Input price, raises ValueError if it is not a positive number
+        """
         if not isinstance(price, Number) or price < 0:
             raise ValueError('Price must be a positive number. Input price is : {0}'.format(price))
-        dividendYield = None
-        stockRecord = self.stocks[symbol]
-        if stockRecord[gbce_trading_config.TYPE] == gbce_trading_config.StockType.COMMON:
-            try:
-                dividendYield = stockRecord[gbce_trading_config.LAST_DIVIDEND] / price
-            except ZeroDivisionError:
-                logging.info('Price is zero hence Dividend yield cannot be calculated')
-        else:
-            try:
-                dividendYield = (stockRecord[gbce_trading_config.FIXED_DIVIDEND] * stockRecord[gbce_trading_config.PAR_VALUE]) / price
-            except ZeroDivisionError:
-                logging.info('Price is zero hence Dividend yield cannot be calculated' )
-        return dividendYield
 
-    def getPERatio(self, symbol, price):
+    @staticmethod
+    def _validateDividendNumerator(stockRecord):
         """
-        :param symbol: The symbol that identifies the stock
+        :param stockRecord: StockRecord of the stock, raises ValueError if its Dividend Yield cannot be calculated
+        """
+        if stockRecord.dividendNumerator is None:
+            raise ValueError('Fixed Dividend and Par Value are required for Preferred stock to calculate Dividend Yield and PE Ratio')
+
+    @staticmethod
+    def _dividendYield(stockRecord, price):
+        """
+        Unchecked Dividend Yield, price and dividendNumerator must already be validated
+        :param stockRecord: StockRecord of the stock
+        :param price: Input price for which Dividend Yield to be calculated
+        :return: Dividend for the stock at given input price
+        """
+        if price == 0:
+            logging.info('Price is zero hence Dividend yield cannot be calculated')
+            return None
+        return stockRecord.dividendNumerator / price
+
+    @staticmethod
+    def _peRatio(stockRecord, price):
+        """
+        Unchecked PE ratio, price and dividendNumerator must already be validated
+        :param stockRecord: StockRecord of the stock
         :param price: Input price for which PE ratio to be calculated
         :return: PE ratio for the stock at given input price
         """
-        if symbol not in self.stocks:
-            raise ValueError('Symbol {0} is not present in current stocks. Please consider adding details for {0}'.format(symbol))
-        if not isinstance(price, Number) or price < 0:
-            raise ValueError('Price must be a positive number. Input price is : {0}'.format(price))
+        if price == 0:
+            logging.info('Price is zero hence Dividend yield and PE Ratio cannot be calculated')
+            return None
         peratio = None
         try:
-            peratio = price / self.getDividendYield(symbol=symbol, price=price)
+            # price / (dividendNumerator / price) without computing the dividend yield
+            peratio = price * price / stockRecord.dividendNumerator
         except ZeroDivisionError:
             logging.info('Dividend Yield is zero hence PE Ratio cannot be calculated')
-        except TypeError:
-            logging.info('Price is zero hence Dividend yield and PE Ratio cannot be calculated')
         return peratio
 
+    def getDividendYield(self, symbol, price):
+        """
+        :param symbol: The symbol that identifies the stock
+        :param price: Input price for which Dividend Yield to be calculated
+        :return: Dividend for the stock at given input price
+        """
+        stockRecord = self._getStockRecord(symbol)
+        self._validatePrice(price)
+        self._validateDividendNumerator(stockRecord)
+        return self._dividendYield(stockRecord, price)
+
+    def getPERatio(self, symbol, price):
+        """
+        :param symbol: The symbol that identifies the stock
+        :param price: Input price for which PE ratio to be calculated
+        :return: PE ratio for the stock at given input price
+        """
+        stockRecord = self._getStockRecord(symbol)
+        self._validatePrice(price)
+        self._validateDividendNumerator(stockRecord)
+        return self._peRatio(stockRecord, price)
+
+    def getDividendYields(self, symbol, prices):
+        """
+        :param symbol: The symbol that identifies the stock
+        :param prices: Iterable of input prices for which Dividend Yield to be calculated
+        :return: List of Dividend for the stock at each input price, None where price is zero
+        """
+        stockRecord = self._getStockRecord(symbol)
+        prices = list(prices)
+        for price in prices:
+            self._validatePrice(price)
+        self._validateDividendNumerator(stockRecord)
+        return [self._dividendYield(stockRecord, price) for price in prices]
+
+    def getPERatios(self, symbol, prices):
+        """
+        :param symbol: The symbol that identifies the stock
+        :param prices: Iterable of input prices for which PE ratio to be calculated
+        :return: List of PE ratio for the stock at each input price, None where price or Dividend Yield is zero
+        """
+        stockRecord = self._getStockRecord(symbol)
+        prices = list(prices)
+        for price in prices:
+            self._validatePrice(price)
+        self._validateDividendNumerator(stockRecord)
+        return [self._peRatio(stockRecord, price) for price in prices]
+
+    def getAllDividendYields(self, price):
+        """
+        :param price: Input price for which Dividend Yield to be calculated
+        :return: dict of Dividend for every stock of the exchange at given input price, None values if price is zero or if
+        Dividend Yield of the stock cannot be calculated
+        """
+        self._validatePrice(price)
+        if price == 0:
+            logging.info('Price is zero hence Dividend yield cannot be calculated')
+            return dict.fromkeys(self.stocks)
+        return {symbol: None if stockRecord.dividendNumerator is None else stockRecord.dividendNumerator / price
+                for symbol, stockRecord in self.stocks.items()}
+
     def getVolumeWeightedStockPrice(self, symbol):
         """
         :param symbol: The symbol that identifies the stock
         :return: Volume Weighted Stock Price for a given stock based on trades in past 5 minutes
         """
-        if symbol not in self.stocks:
-            raise ValueError('Symbol {0} is not present in current stocks. Please consider adding details for {0}'.format(symbol))
-        volumeWeightedStockPrice = None
-        currentTime = datetime.datetime.now()
-        allTrades = self.stocks[symbol][gbce_trading_config.TRADES]
-        requiredTrades = [trade for trade in allTrades if trade.timestamp >= currentTime - gbce_trading_config.TIME_INTERVAL]
-        if len(requiredTrades) > 0:
-            tradePrices = (trade.totalPrice for trade in requiredTrades)
-            quantities = (trade.quantity for trade in requiredTrades)
-            volumeWeightedStockPrice = sum(tradePrices) / sum(quantities)
-        return volumeWeightedStockPrice
+        return self._getStockRecord(symbol).trades.volumeWeightedPrice(_epochNanoseconds(datetime.datetime.now()))
 
     def getGBCEAllShareIndex(self):
         """
         :return: Returns the GBCE All Share Index using the geometric mean of the Volume Weighted Stock Price for all Stocks
         """
+        now = _epochNanoseconds(datetime.datetime.now())
+        # Cached index stays valid until any stock's TradeWindow is replaced or gains a trade, or its oldest trade expires
+        if self._allShareIndexWindows is not None and len(self._allShareIndexWindows) == len(self.stocks) \
+                and (self._allShareIndexExpiresAt is None or now < self._allShareIndexExpiresAt) \
+                and all(stockRecord.trades is tradeWindow and tradeWindow.generation == generation
+                        for stockRecord, (tradeWindow, generation) in zip(self.stocks.values(), self._allShareIndexWindows)):
+            return self._allShareIndex
         allShareIndex = None
         volumeWeightedStockPrices = [self.getVolumeWeightedStockPrice(symbol) for symbol in self.stocks]
-        if not None in volumeWeightedStockPrices:
-            product = reduce(operator.mul, volumeWeightedStockPrices, 1)
-            allShareIndex = product**(1/len(self.stocks))
+        if volumeWeightedStockPrices and not None in volumeWeightedStockPrices and min(volumeWeightedStockPrices) > 0:
+            # Geometric mean taken in log space (exp of fmean over map(log)), the running product overflows for large exchanges
+            allShareIndex = statistics.geometric_mean(volumeWeightedStockPrices)
+        expiries = [stockRecord.trades.expiresAt for stockRecord in self.stocks.values() if stockRecord.trades]
+        self._allShareIndex = allShareIndex
+        self._allShareIndexWindows = [(stockRecord.trades, stockRecord.trades.generation) for stockRecord in self.stocks.values()]
+        self._allShareIndexExpiresAt = min(expiries) if expiries else None
         return allShareIndex
 
 
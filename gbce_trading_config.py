@@ -1,3 +1,4 @@
+from dataclasses import dataclass, field
 from datetime import timedelta
 
 """ Config is maintained so that if there are any nomenclature/constant value changes required later, they can be made at a single place
@@ -9,6 +10,7 @@ LAST_DIVIDEND = 'Last Dividend'
 FIXED_DIVIDEND = 'Fixed Dividend'
 PAR_VALUE = 'Par Value'
 TRADES = 'Trades'
+STOCK_RECORD_FIELDS = {TYPE: 'type', LAST_DIVIDEND: 'lastDividend', FIXED_DIVIDEND: 'fixedDividend', PAR_VALUE: 'parValue', TRADES: 'trades'}
 
 # Trade config
 TIMESTAMP = 'Time Stamp'
@@ -16,6 +18,41 @@ QUANTITY = 'Quantity'
 TRADE_TYPE = 'TradeType'
 PRICE = 'Price'
 
+@dataclass(slots=True, frozen=True)
+class StockRecord(object):
+    """ Details of a stock held in exchange, attributes are slots so lookups avoid hashing the string keys above.
+    Frozen so that the derived dividendNumerator cannot go stale, replace the record to change stock details """
+    type: str
+    lastDividend: float
+    fixedDividend: float | None
+    parValue: float | None
+    trades: object
+    dividendNumerator: float | None = field(init=False)
+
+    def __post_init__(self):
+        # Dividend yield is dividendNumerator / price, precomputed as it depends only on the stock type and details
+        # None for a Preferred stock without Fixed Dividend or Par Value, Dividend Yield and PE Ratio report it as ValueError
+        if self.type == StockType.COMMON:
+            dividendNumerator = self.lastDividend
+        elif self.fixedDividend is None or self.parValue is None:
+            dividendNumerator = None
+        else:
+            dividendNumerator = self.fixedDividend * self.parValue
+        object.__setattr__(self, 'dividendNumerator', dividendNumerator)
+
+    def __getitem__(self, key):
+        # Compatibility with the earlier dict records keyed by the Stock config names
+        return getattr(self, STOCK_RECORD_FIELDS[key])
+
+    @classmethod
+    def fromDict(cls, details):
+        """
+        :param details: dict keyed by the Stock config names, Fixed Dividend, Par Value and Trades are optional
+        :return: StockRecord with same details
+        """
+        details = {FIXED_DIVIDEND: None, PAR_VALUE: None, TRADES: (), **details}
+        return cls(**{attribute: details[key] for key, attribute in STOCK_RECORD_FIELDS.items()})
+
 class StockType(object):
     COMMON = 'Common'
     PREFERRED = 'Preferred'
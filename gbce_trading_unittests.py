@@ -1,7 +1,10 @@
+import dataclasses
 import datetime
+import time
 import unittest
+from unittest import mock
 import gbce_trading_config
-from gbce_trading import GBCETrading, Stock, Trade
+from gbce_trading import Exchange, GBCETrading, Stock, Trade, TradeWindow
 
 class GBCEUnitTests(unittest.TestCase):
     def test_getDividendYield(self):
@@ -14,6 +17,16 @@ class GBCEUnitTests(unittest.TestCase):
         stockPref = {'JOE': {'Type': 'Preferred', 'Last Dividend': 18, 'Fixed Dividend': 4, 'Par Value': 200, 'Trades': []}}
         testObj2 = GBCETrading(stockPref)
         self.assertAlmostEqual(testObj2.getDividendYield(symbol='JOE', price=254.5), 3.143, 2)
+        testObj3 = GBCETrading({'POP': {'Type': 'Common', 'Last Dividend': 8}})
+        self.assertEqual(testObj3.getDividendYield(symbol='POP', price=160.0), 0.05)
+        self.assertEqual(testObj3.getVolumeWeightedStockPrice(symbol='POP'), None)
+        trade = Trade(symbol='ALE', quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=60.0)
+        stockAle = gbce_trading_config.StockRecord(type=gbce_trading_config.StockType.COMMON, lastDividend=23, fixedDividend=None, parValue=60, trades=[trade])
+        stockPop = gbce_trading_config.StockRecord.fromDict({'Type': 'Common', 'Last Dividend': 8})
+        testObj4 = GBCETrading({'ALE': stockAle, 'POP': stockPop})
+        self.assertEqual(testObj4.getDividendYield(symbol='POP', price=160.0), 0.05)
+        self.assertAlmostEqual(testObj4.getVolumeWeightedStockPrice(symbol='ALE'), 60.0, 6)
+        self.assertEqual(testObj4.getVolumeWeightedStockPrice(symbol='POP'), None)
 
     def test_getPERatio(self):
         stockComm = {'ALE': {'Type': 'Common', 'Last Dividend': 23, 'Fixed Dividend': None, 'Par Value': 60, 'Trades': []}}
@@ -25,6 +38,40 @@ class GBCEUnitTests(unittest.TestCase):
         stockPref = {'GIN': {'Type': 'Preferred', 'Last Dividend': 24, 'Fixed Dividend': 14, 'Par Value': 250, 'Trades': []}}
         testObj2 = GBCETrading(stockPref)
         self.assertEqual(testObj2.getPERatio(symbol='GIN', price=350), 35)
+        stockPref = Stock(symbol='BEE', exchange=Exchange())
+        stockPref.addStockDetails(type=gbce_trading_config.StockType.PREFERRED, lastDividend=8, parValue=100)
+        stockPref.recordTrade(Trade(symbol='BEE', quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=50.0))
+        testObj3 = GBCETrading(exchange=stockPref.exchange)
+        self.assertRaises(ValueError, testObj3.getPERatio, symbol='BEE', price=50.0)
+        self.assertRaises(ValueError, testObj3.getDividendYield, symbol='BEE', price=50.0)
+        self.assertEqual(testObj3.getAllDividendYields(price=50.0), {'BEE': None})
+        self.assertAlmostEqual(testObj3.getGBCEAllShareIndex(), 50.0, 6)
+
+    def test_getDividendYieldsAndPERatios(self):
+        stocks = {'ALE': {'Type': 'Common', 'Last Dividend': 23, 'Fixed Dividend': None, 'Par Value': 60, 'Trades': []},
+                  'TEA': {'Type': 'Common', 'Last Dividend': 0, 'Fixed Dividend': None, 'Par Value': 100, 'Trades': []}}
+        testObj = GBCETrading(stocks)
+        prices = [88.0, 0, 115]
+        self.assertEqual(testObj.getDividendYields(symbol='ALE', prices=prices), [testObj.getDividendYield(symbol='ALE', price=price) for price in prices])
+        self.assertEqual(testObj.getPERatios(symbol='ALE', prices=prices), [testObj.getPERatio(symbol='ALE', price=price) for price in prices])
+        self.assertEqual(testObj.getPERatios(symbol='TEA', prices=prices), [None, None, None])
+        self.assertRaises(ValueError, testObj.getDividendYields, symbol='ALE', prices=[10, -1])
+        self.assertRaises(ValueError, testObj.getPERatios, symbol='XYZ', prices=[10])
+
+    def test_getAllDividendYields(self):
+        stocks = {'POP': {'Type': 'Common', 'Last Dividend': 8, 'Fixed Dividend': None, 'Par Value': 100, 'Trades': []},
+                  'JOE': {'Type': 'Preferred', 'Last Dividend': 18, 'Fixed Dividend': 4, 'Par Value': 200, 'Trades': []}}
+        testObj = GBCETrading(stocks)
+        self.assertEqual(testObj.getAllDividendYields(price=160.0), {'POP': 0.05, 'JOE': 5.0})
+        self.assertEqual(testObj.getAllDividendYields(price=0), {'POP': None, 'JOE': None})
+        self.assertRaises(ValueError, testObj.getAllDividendYields, price=-1)
+        exchange = Exchange()
+        stockPop = Stock(symbol='POP', exchange=exchange)
+        stockPop.addStockDetails(type=gbce_trading_config.StockType.COMMON, lastDividend=8, parValue=100)
+        stockPop.addStockDetails(type=gbce_trading_config.StockType.PREFERRED, lastDividend=8, parValue=100, fixedDividend=2)
+        self.assertEqual(GBCETrading(exchange=exchange).getAllDividendYields(price=10.0), {'POP': 0.2})
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            exchange.stocks['POP'].lastDividend = 16
 
     def test_getVolumeWeightedStockPrice(self):
         trade1 = Trade(symbol='TEA', quantity=100, tradeType=gbce_trading_config.TradeType.BUY, price=120.5)
@@ -42,6 +89,39 @@ class GBCEUnitTests(unittest.TestCase):
         self.assertRaises(ValueError, testObj.getVolumeWeightedStockPrice, symbol='PQR')
         self.assertEqual(testObj.getVolumeWeightedStockPrice(symbol='GIN'), None)
 
+    def test_recordTrade(self):
+        stockPop = Stock(symbol=''.join(['PO', 'P']), exchange=Exchange())
+        stockPop.addStockDetails(type=gbce_trading_config.StockType.COMMON, lastDividend=8, parValue=100)
+        stockPop.recordTrade(Trade(symbol=''.join(['P', 'OP']), quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=100.0))
+        self.assertEqual(len(stockPop.trades), 1)
+        self.assertRaises(ValueError, stockPop.recordTrade, Trade(symbol='TEA', quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=100.0))
+        self.assertRaises(TypeError, stockPop.recordTrade, 'POP')
+
+    def test_tradeDefaultTimestamp(self):
+        trade1 = Trade(symbol='POP', quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=100.0)
+        time.sleep(0.01)
+        trade2 = Trade(symbol='POP', quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=100.0)
+        self.assertLess(trade1.timestamp, trade2.timestamp)
+        self.assertLess(trade1.timestampNs, trade2.timestampNs)
+
+    def test_tradeWindowEviction(self):
+        now = datetime.datetime.now()
+        trade1 = Trade(symbol='TEA', quantity=100, tradeType=gbce_trading_config.TradeType.BUY, price=120.0, timestamp=now - datetime.timedelta(minutes=1))
+        trade2 = Trade(symbol='TEA', quantity=50, tradeType=gbce_trading_config.TradeType.SELL, price=150.0, timestamp=now - datetime.timedelta(minutes=3))
+        tradeWindow = TradeWindow([trade1, trade2])
+        self.assertEqual(len(tradeWindow), 2)
+        self.assertAlmostEqual(tradeWindow.volumeWeightedPrice(round(now.timestamp() * 1e9)), 130.0, 6)
+        self.assertAlmostEqual(tradeWindow.volumeWeightedPrice(round((now + datetime.timedelta(minutes=3)).timestamp() * 1e9)), 120.0, 6)
+        self.assertEqual(len(tradeWindow), 1)
+        self.assertEqual(tradeWindow.volumeWeightedPrice(round((now + datetime.timedelta(minutes=5)).timestamp() * 1e9)), None)
+
+    def test_tradeWindowEvictionPrecision(self):
+        now = datetime.datetime.now()
+        trade1 = Trade(symbol='TEA', quantity=1000000, tradeType=gbce_trading_config.TradeType.BUY, price=1e6, timestamp=now - datetime.timedelta(minutes=3))
+        trade2 = Trade(symbol='TEA', quantity=1, tradeType=gbce_trading_config.TradeType.SELL, price=0.1, timestamp=now - datetime.timedelta(minutes=1))
+        tradeWindow = TradeWindow([trade1, trade2])
+        self.assertEqual(tradeWindow.volumeWeightedPrice(round((now + datetime.timedelta(minutes=3)).timestamp() * 1e9)), 0.1)
+
     def test_getGBCEAllShareIndex(self):
         trade1 = Trade(symbol='TEA', quantity=100, tradeType=gbce_trading_config.TradeType.BUY, price=120.5)
         trade2 = Trade(symbol='TEA', quantity=50, tradeType=gbce_trading_config.TradeType.SELL, price=125.4)
@@ -57,5 +137,55 @@ class GBCEUnitTests(unittest.TestCase):
         stockGin.recordTrade(trade3)
         self.assertAlmostEqual(testObj.getGBCEAllShareIndex(), 165.918, 2)
 
+    def test_separateExchanges(self):
+        exchange1 = Exchange()
+        exchange2 = Exchange()
+        stockTea1 = Stock(symbol='TEA', exchange=exchange1)
+        stockTea1.addStockDetails(type=gbce_trading_config.StockType.COMMON, lastDividend=0, parValue=100)
+        stockTea1.recordTrade(Trade(symbol='TEA', quantity=100, tradeType=gbce_trading_config.TradeType.BUY, price=120.0))
+        stockTea2 = Stock(symbol='TEA', exchange=exchange2)
+        stockTea2.addStockDetails(type=gbce_trading_config.StockType.COMMON, lastDividend=0, parValue=100)
+        stockTea2.recordTrade(Trade(symbol='TEA', quantity=100, tradeType=gbce_trading_config.TradeType.BUY, price=80.0))
+        self.assertAlmostEqual(GBCETrading(exchange=exchange1).getGBCEAllShareIndex(), 120.0, 6)
+        self.assertAlmostEqual(GBCETrading(exchange=exchange2).getGBCEAllShareIndex(), 80.0, 6)
+        self.assertIsNot(Stock.getAllStocks(), exchange1.stocks)
+        testObjAlias = GBCETrading(exchange1.stocks)
+        stockPop1 = Stock(symbol='POP', exchange=exchange1)
+        stockPop1.addStockDetails(type=gbce_trading_config.StockType.COMMON, lastDividend=8, parValue=100)
+        self.assertIs(testObjAlias.stocks, exchange1.stocks)
+        self.assertEqual(testObjAlias.getDividendYield(symbol='POP', price=160.0), 0.05)
+        del exchange1.stocks['POP']
+        testObj1 = GBCETrading(exchange=exchange1)
+        testObj1.getGBCEAllShareIndex()
+        stockTea2.recordTrade(Trade(symbol='TEA', quantity=100, tradeType=gbce_trading_config.TradeType.BUY, price=90.0))
+        with mock.patch.object(GBCETrading, 'getVolumeWeightedStockPrice', side_effect=AssertionError('index recomputed')):
+            self.assertAlmostEqual(testObj1.getGBCEAllShareIndex(), 120.0, 6)
+
+    def test_getGBCEAllShareIndexLargeExchange(self):
+        stocks = {}
+        for i in range(400):
+            symbol = 'S{0}'.format(i)
+            trade = Trade(symbol=symbol, quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=1e4)
+            stocks[symbol] = {'Type': 'Common', 'Last Dividend': 8, 'Fixed Dividend': None, 'Par Value': 100, 'Trades': [trade]}
+        testObj = GBCETrading(stocks)
+        self.assertAlmostEqual(testObj.getGBCEAllShareIndex(), 1e4, 6)
+
+    def test_getGBCEAllShareIndexCache(self):
+        trade1 = Trade(symbol='ALE', quantity=10, tradeType=gbce_trading_config.TradeType.BUY, price=60.0)
+        tradeWindow = TradeWindow([trade1], interval=datetime.timedelta(milliseconds=500))
+        stockAle = gbce_trading_config.StockRecord(type=gbce_trading_config.StockType.COMMON, lastDividend=23, fixedDividend=None, parValue=60, trades=tradeWindow)
+        testObj = GBCETrading({'ALE': stockAle})
+        self.assertAlmostEqual(testObj.getGBCEAllShareIndex(), 60.0, 6)
+        # Cache hit must not recompute any Volume Weighted Stock Price
+        with mock.patch.object(GBCETrading, 'getVolumeWeightedStockPrice', side_effect=AssertionError('index recomputed')):
+            self.assertAlmostEqual(testObj.getGBCEAllShareIndex(), 60.0, 6)
+        trade2 = Trade(symbol='ALE', quantity=10, tradeType=gbce_trading_config.TradeType.SELL, price=90.0)
+        tradeWindow.append(trade2)
+        with mock.patch.object(GBCETrading, 'getVolumeWeightedStockPrice', wraps=testObj.getVolumeWeightedStockPrice) as vwap:
+            self.assertAlmostEqual(testObj.getGBCEAllShareIndex(), 75.0, 6)
+            self.assertEqual(vwap.call_count, 1)
+        time.sleep(0.6)
+        self.assertEqual(testObj.getGBCEAllShareIndex(), None)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file